@@ -12,88 +12,329 @@ It compares normal and obfuscated versions to compute metrics like:
 Usage:
     python analyze_obfuscation.py normal_binary obfuscated_binary
 
+Either argument may also be a saved ``objdump -d`` listing (such as the
+.asm files written by run_ghidra_test.sh) instead of a binary.
+
+Parsed disassembly is cached under ~/.cache/morphect/ (or
+$XDG_CACHE_HOME/morphect/), so re-running against an unchanged binary
+skips objdump entirely. Set MORPHECT_NO_CACHE=1 to bypass the cache.
+
 Requirements:
     - objdump (for disassembly)
     - Python 3.6+
+    - NumPy (optional, vectorizes entropy for large mnemonic alphabets)
 """
 
+import os
 import sys
+import shutil
 import subprocess
+import threading
 import re
 import math
+import mmap
+import hashlib
+import pickle
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 
-
-def run_objdump(binary_path):
-    """Run objdump and return disassembly."""
-    result = subprocess.run(
-        ['objdump', '-d', binary_path],
-        capture_output=True,
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# objdump line grammar, matched once per line:
+#   0000000000001234 <function_name>:
+#     1234:	48 89 e5             	mov    %rsp,%rbp
+_LINE_RE = re.compile(
+    r'(?:(?P<func>[0-9a-f]+) <(?P<fname>[^>]+)>:'
+    r'|[ \t]+[0-9a-f]+:[ \t]+(?P<bytes>[0-9a-f ]+)[ \t]+(?P<mnem>\S+))'
+)
+
+# The same grammar over raw bytes, scanned across a whole mapped file
+_LINE_RE_BYTES = re.compile(
+    rb'^(?:(?P<func>[0-9a-f]+) <(?P<fname>[^>]+)>:'
+    rb'|[ \t]+[0-9a-f]+:[ \t]+(?P<bytes>[0-9a-f ]+)[ \t]+(?P<mnem>\S+))',
+    re.MULTILINE
+)
+
+# Header objdump prints at the top of a listing: "a.out:     file format elf64-x86-64"
+_DISASM_HEADER_RE = re.compile(rb'^\S.*:\s+file format \S+', re.MULTILINE)
+
+# Canonical str object for every mnemonic seen, shared by all parses so
+# each distinct mnemonic is stored once across both binaries
+_MNEM_INTERN = {}
+
+# Pipe buffer for objdump's stdout, large enough to keep objdump running
+# while the parser catches up
+_OBJDUMP_BUFSIZE = 1 << 20
+
+# Seconds a single objdump run may take before it is killed
+_OBJDUMP_TIMEOUT = 600
+
+# Parsed disassembly is cached on disk, one entry per binary path.
+# Bump _CACHE_VERSION whenever the cache entry format changes.
+_CACHE_VERSION = 2
+
+# Instruction categories, keyed by the metric each one increments
+_BRANCH_MNEMONICS = frozenset({'je', 'jne', 'jg', 'jge', 'jl', 'jle', 'ja', 'jae',
+                               'jb', 'jbe', 'jmp', 'jo', 'jno', 'js', 'jns', 'jz', 'jnz'})
+_CALL_MNEMONICS = frozenset({'call', 'callq', 'callw', 'calll'})
+_ARITHMETIC_MNEMONICS = frozenset({'add', 'sub', 'mul', 'imul', 'div', 'idiv', 'inc', 'dec', 'neg'})
+_BITWISE_MNEMONICS = frozenset({'and', 'or', 'xor', 'not', 'shl', 'shr', 'sar', 'sal', 'rol', 'ror'})
+_MEMORY_MNEMONICS = frozenset({'mov', 'movzx', 'movsx', 'lea', 'push', 'pop'})
+
+_MNEMONIC_CATEGORY = {
+    **dict.fromkeys(_BRANCH_MNEMONICS, 'branch_count'),
+    **dict.fromkeys(_CALL_MNEMONICS, 'call_count'),
+    **dict.fromkeys(_ARITHMETIC_MNEMONICS, 'arithmetic_count'),
+    **dict.fromkeys(_BITWISE_MNEMONICS, 'bitwise_count'),
+    **dict.fromkeys(_MEMORY_MNEMONICS, 'memory_count'),
+}
+
+_INV_LN2 = 1 / math.log(2)
+
+# Below this many distinct mnemonics the NumPy setup costs more than it saves
+_NUMPY_MIN_SYMBOLS = 32
+
+
+def start_objdump(binary_path, section=None, stderr=None):
+    """Start objdump on a binary, optionally restricted to one section.
+
+    The disassembly is read from the returned process's stdout.
+    """
+    args = ['objdump', '-d']
+    if section:
+        args += ['-j', section]
+    return subprocess.Popen(
+        args + [binary_path],
+        stdout=subprocess.PIPE,
+        stderr=stderr,
+        bufsize=_OBJDUMP_BUFSIZE,
         text=True
     )
-    return result.stdout
 
 
-def parse_functions(disassembly):
-    """Parse disassembly into functions."""
+def parse_functions(lines):
+    """Parse disassembly lines into functions.
+
+    Accepts any iterable of lines, so objdump's stdout can be parsed while
+    it is still being written. Returns a dict mapping each function name to
+    a pair of parallel lists: the instruction mnemonics and the encoded
+    length of each instruction in bytes.
+    """
     functions = {}
-    current_func = None
-    current_instructions = []
-
-    for line in disassembly.split('\n'):
-        # Function header: 0000000000001234 <function_name>:
-        func_match = re.match(r'^[0-9a-f]+ <([^>]+)>:', line)
-        if func_match:
-            if current_func:
-                functions[current_func] = current_instructions
-            current_func = func_match.group(1)
-            current_instructions = []
+    mnemonics = byte_lens = None
+    match = _LINE_RE.match
+    intern = _MNEM_INTERN.setdefault
+
+    for line in lines:
+        m = match(line)
+        if m is None:
             continue
+        if m.lastgroup == 'fname':
+            mnemonics, byte_lens = functions[m.group('fname')] = ([], [])
+        elif mnemonics is not None:
+            bytes_hex = m.group('bytes')
+            # objdump already prints mnemonics in lowercase
+            mnemonic = m.group('mnem')
+            mnemonics.append(intern(mnemonic, mnemonic))
+            byte_lens.append((len(bytes_hex) - bytes_hex.count(' ')) >> 1)
+
+    return functions
 
-        # Instruction line: address: bytes instruction
-        instr_match = re.match(r'^\s+[0-9a-f]+:\s+([0-9a-f ]+)\s+(\S+)', line)
-        if instr_match and current_func:
-            bytes_hex = instr_match.group(1).strip()
-            mnemonic = instr_match.group(2)
-            current_instructions.append({
-                'bytes': bytes_hex,
-                'mnemonic': mnemonic,
-                'full_line': line.strip()
-            })
 
-    if current_func:
-        functions[current_func] = current_instructions
+def parse_functions_file(disasm_path):
+    """Parse a saved objdump disassembly (e.g. ``objdump -d a.out > a.dis``).
+
+    The file is memory-mapped and scanned as bytes, so only the captured
+    function names and mnemonics are ever decoded. Returns the same
+    structure as parse_functions().
+    """
+    functions = {}
+    mnemonics = byte_lens = None
+    intern = _MNEM_INTERN.setdefault
+
+    with open(disasm_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return functions
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for m in _LINE_RE_BYTES.finditer(mm):
+                if m.lastgroup == 'fname':
+                    mnemonics, byte_lens = functions[m.group('fname').decode()] = ([], [])
+                elif mnemonics is not None:
+                    bytes_hex = m.group('bytes')
+                    mnemonic = m.group('mnem').decode()
+                    mnemonics.append(intern(mnemonic, mnemonic))
+                    byte_lens.append((len(bytes_hex) - bytes_hex.count(b' ')) >> 1)
 
     return functions
 
 
-def calculate_entropy(data):
-    """Calculate Shannon entropy of data."""
-    if not data:
-        return 0
+def _disassemble(binary_path, section=None, stderr=None):
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        objdump.kill()
+
+    with start_objdump(binary_path, section, stderr) as objdump:
+        watchdog = threading.Timer(_OBJDUMP_TIMEOUT, kill)
+        watchdog.start()
+        try:
+            functions = parse_functions(objdump.stdout)
+        finally:
+            watchdog.cancel()
+
+    if timed_out.is_set():
+        raise subprocess.TimeoutExpired(objdump.args, _OBJDUMP_TIMEOUT)
+    if objdump.returncode != 0:
+        raise subprocess.CalledProcessError(objdump.returncode, objdump.args)
+
+    return functions
+
+
+def is_disassembly(path):
+    """Return True if path is a saved objdump listing rather than a binary.
+
+    Anything that cannot be read as a file is treated as a binary and left
+    for objdump to report.
+    """
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(4096)
+    except OSError:
+        return False
+    return _DISASM_HEADER_RE.search(head) is not None
+
+
+def disassemble(binary_path):
+    """Disassemble a binary, parsing objdump's output as it streams in.
+
+    Only the .text section is disassembled when the binary has one. If
+    objdump rejects that (e.g. Mach-O, whose code lives in __text), it is
+    re-run over every executable section.
+
+    Raises subprocess.TimeoutExpired if an objdump run takes longer than
+    _OBJDUMP_TIMEOUT (applied to each run, so a fallback can double the
+    total), and subprocess.CalledProcessError if it fails.
+    """
+    try:
+        return _disassemble(binary_path, '.text', subprocess.DEVNULL)
+    except subprocess.CalledProcessError:
+        return _disassemble(binary_path)
+
+
+def _cache_dir():
+    """Return the parse cache directory, or None if caching is disabled."""
+    if os.environ.get('MORPHECT_NO_CACHE'):
+        return None
+
+    cache_home = os.environ.get('XDG_CACHE_HOME')
+    if not cache_home:
+        # Path.home() raises when no home directory can be determined
+        try:
+            cache_home = Path.home() / '.cache'
+        except (RuntimeError, KeyError):
+            return None
+
+    return Path(cache_home) / 'morphect'
+
+
+@lru_cache(maxsize=None)
+def _load_or_parse(binary_path, size, mtime_ns, is_listing):
+    parse = parse_functions_file if is_listing else disassemble
+
+    cache_dir = _cache_dir()
+    if cache_dir is None:
+        return parse(binary_path)
+
+    # One entry per binary path: a rebuilt binary overwrites its own entry,
+    # and the stored size/mtime decide whether that entry is still current
+    key = f'{_CACHE_VERSION}:{binary_path}'
+    cache_path = cache_dir / (hashlib.sha1(key.encode()).hexdigest() + '.pickle')
+
+    try:
+        with open(cache_path, 'rb') as f:
+            cached_size, cached_mtime_ns, functions = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, TypeError, ValueError):
+        pass
+    else:
+        if (cached_size, cached_mtime_ns) == (size, mtime_ns):
+            # Unpickled strings are fresh objects; route them through the
+            # shared table so cached and freshly parsed binaries share
+            # mnemonics too
+            intern = _MNEM_INTERN.setdefault
+            for mnemonics, _ in functions.values():
+                mnemonics[:] = [intern(mnemonic, mnemonic) for mnemonic in mnemonics]
+            return functions
+
+    functions = parse(binary_path)
+
+    # Write to a temporary file first so a concurrent reader never sees a
+    # partial pickle; a cache that cannot be written is not an error
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_suffix(f'.{os.getpid()}.tmp')
+        with open(tmp_path, 'wb') as f:
+            pickle.dump((size, mtime_ns, functions), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+
+    return functions
+
+
+def load_or_parse(binary_path, is_listing=False):
+    """Return parse_functions() output for a binary, reusing cached results.
+
+    A saved objdump listing (is_listing=True) is parsed directly with
+    parse_functions_file().
 
-    counter = Counter(data)
-    total = len(data)
-    entropy = 0
+    Results are memoized in-process and on disk under ~/.cache/morphect/,
+    one entry per resolved path, reused only while the binary's size and
+    modification time are unchanged, so an unchanged binary is never
+    disassembled twice. Set MORPHECT_NO_CACHE to
+    skip the on-disk cache.
+    """
+    binary_path = str(Path(binary_path).resolve())
+    st = os.stat(binary_path)
+    return _load_or_parse(binary_path, st.st_size, st.st_mtime_ns, is_listing)
+
+
+def calculate_entropy(counts, total):
+    """Calculate Shannon entropy from per-symbol occurrence counts."""
+    if not total:
+        return 0
 
-    for count in counter.values():
-        prob = count / total
-        if prob > 0:
-            entropy -= prob * math.log2(prob)
+    if np is not None and len(counts) >= _NUMPY_MIN_SYMBOLS:
+        probs = np.fromiter(counts, dtype=np.float64, count=len(counts)) / total
+        return float(-(probs * np.log2(probs)).sum())
 
-    return entropy
+    # H = log2(total) - sum(c * log2(c)) / total, in natural logs: one
+    # math.log per distinct symbol instead of a division and log2 each.
+    # Clamp the rounding error a single-symbol input can leave below zero
+    log = math.log
+    weighted = 0.0
+    for count in counts:
+        weighted += count * log(count)
+    return max(0.0, (log(total) - weighted / total) * _INV_LN2)
 
 
-def analyze_function(instructions):
+def analyze_function(mnemonics, byte_lens):
     """Analyze a function and return metrics."""
-    if not instructions:
+    if not mnemonics:
         return None
 
+    mnemonic_counts = Counter(mnemonics)
+
     metrics = {
-        'instruction_count': len(instructions),
-        'unique_mnemonics': len(set(i['mnemonic'] for i in instructions)),
-        'byte_count': 0,
+        'instruction_count': len(mnemonics),
+        'unique_mnemonics': len(mnemonic_counts),
+        'byte_count': sum(byte_lens),
         'branch_count': 0,
         'call_count': 0,
         'arithmetic_count': 0,
@@ -101,63 +342,79 @@ def analyze_function(instructions):
         'memory_count': 0,
     }
 
-    branch_mnemonics = {'je', 'jne', 'jg', 'jge', 'jl', 'jle', 'ja', 'jae',
-                        'jb', 'jbe', 'jmp', 'jo', 'jno', 'js', 'jns', 'jz', 'jnz'}
-    arithmetic_mnemonics = {'add', 'sub', 'mul', 'imul', 'div', 'idiv', 'inc', 'dec', 'neg'}
-    bitwise_mnemonics = {'and', 'or', 'xor', 'not', 'shl', 'shr', 'sar', 'sal', 'rol', 'ror'}
-    memory_mnemonics = {'mov', 'movzx', 'movsx', 'lea', 'push', 'pop'}
-
-    mnemonics = []
-    for instr in instructions:
-        mnemonic = instr['mnemonic'].lower()
-        mnemonics.append(mnemonic)
-
-        # Count bytes
-        byte_str = instr['bytes'].replace(' ', '')
-        metrics['byte_count'] += len(byte_str) // 2
-
-        # Categorize instruction
-        if mnemonic in branch_mnemonics:
-            metrics['branch_count'] += 1
-        elif mnemonic.startswith('call'):
-            metrics['call_count'] += 1
-        elif mnemonic in arithmetic_mnemonics:
-            metrics['arithmetic_count'] += 1
-        elif mnemonic in bitwise_mnemonics:
-            metrics['bitwise_count'] += 1
-        elif mnemonic in memory_mnemonics:
-            metrics['memory_count'] += 1
+    categories = _MNEMONIC_CATEGORY
+
+    # Categorize each distinct mnemonic once, weighted by its count
+    for mnemonic, count in mnemonic_counts.items():
+        category = categories.get(mnemonic)
+        if category is not None:
+            metrics[category] += count
 
     # Calculate entropy
-    metrics['mnemonic_entropy'] = calculate_entropy(mnemonics)
+    metrics['mnemonic_entropy'] = calculate_entropy(mnemonic_counts.values(),
+                                                    len(mnemonics))
 
     return metrics
 
 
-def compare_binaries(normal_path, obfuscated_path):
-    """Compare normal and obfuscated binaries."""
+def compile_matcher(needles):
+    """Build a predicate testing whether a name contains any of the needles.
+
+    The needles are baked into a generated function as string constants,
+    so each call is a flat chain of ``in`` checks with no loop.
+    """
+    if not needles:
+        return lambda name: False
+
+    source = 'def match(name):\n    return ' + ' or '.join(
+        f'{needle!r} in name' for needle in needles)
+    namespace = {}
+    exec(source, namespace)
+    return namespace['match']
+
+
+def build_index(funcs, needles):
+    """Map each needle to the first function name that contains it."""
+    match = compile_matcher(needles)
+    index = {}
+    for name in funcs:
+        # Most names match nothing; only those that do are checked needle by
+        # needle, which also records needles that overlap one another
+        if not match(name):
+            continue
+        for needle in needles:
+            if needle in name:
+                index.setdefault(needle, name)
+    return index
+
+
+def compare_binaries(normal_path, obfuscated_path,
+                     normal_is_listing=False, obfuscated_is_listing=False):
+    """Compare normal and obfuscated binaries (or saved objdump listings)."""
     print("=" * 60)
     print("Morphect Obfuscation Quality Analysis")
     print("=" * 60)
     print(f"\nNormal binary: {normal_path}")
     print(f"Obfuscated binary: {obfuscated_path}\n")
 
-    # Get file sizes
-    normal_size = Path(normal_path).stat().st_size
-    obfuscated_size = Path(obfuscated_path).stat().st_size
-
-    print(f"Binary sizes:")
-    print(f"  Normal: {normal_size} bytes")
-    print(f"  Obfuscated: {obfuscated_size} bytes")
-    print(f"  Increase: {obfuscated_size - normal_size} bytes " +
-          f"({(obfuscated_size - normal_size) * 100 / normal_size:.1f}%)")
-
-    # Parse disassembly
-    normal_disasm = run_objdump(normal_path)
-    obfuscated_disasm = run_objdump(obfuscated_path)
-
-    normal_funcs = parse_functions(normal_disasm)
-    obfuscated_funcs = parse_functions(obfuscated_disasm)
+    # Get file sizes (meaningless for saved objdump listings)
+    if normal_is_listing or obfuscated_is_listing:
+        print("Binary sizes: n/a (objdump listing given)")
+    else:
+        normal_size = Path(normal_path).stat().st_size
+        obfuscated_size = Path(obfuscated_path).stat().st_size
+
+        print(f"Binary sizes:")
+        print(f"  Normal: {normal_size} bytes")
+        print(f"  Obfuscated: {obfuscated_size} bytes")
+        print(f"  Increase: {obfuscated_size - normal_size} bytes " +
+              f"({(obfuscated_size - normal_size) * 100 / normal_size:.1f}%)")
+
+    # Disassemble and parse both binaries concurrently
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        normal_funcs, obfuscated_funcs = pool.map(
+            load_or_parse, (normal_path, obfuscated_path),
+            (normal_is_listing, obfuscated_is_listing))
 
     # Find common functions (exclude system functions)
     interesting_funcs = [
@@ -169,29 +426,22 @@ def compare_binaries(normal_path, obfuscated_path):
     print("Per-Function Analysis")
     print("=" * 60)
 
+    normal_index = build_index(normal_funcs, interesting_funcs)
+    obfuscated_index = build_index(obfuscated_funcs, interesting_funcs)
+
     total_normal = {'instructions': 0, 'bytes': 0, 'branches': 0}
     total_obfuscated = {'instructions': 0, 'bytes': 0, 'branches': 0}
 
     for func_name in interesting_funcs:
-        normal_match = None
-        obfuscated_match = None
-
-        # Find matching function names (may have prefixes)
-        for name in normal_funcs:
-            if func_name in name:
-                normal_match = name
-                break
-
-        for name in obfuscated_funcs:
-            if func_name in name:
-                obfuscated_match = name
-                break
+        # Function names may have prefixes
+        normal_match = normal_index.get(func_name)
+        obfuscated_match = obfuscated_index.get(func_name)
 
         if not normal_match or not obfuscated_match:
             continue
 
-        normal_metrics = analyze_function(normal_funcs[normal_match])
-        obfuscated_metrics = analyze_function(obfuscated_funcs[obfuscated_match])
+        normal_metrics = analyze_function(*normal_funcs[normal_match])
+        obfuscated_metrics = analyze_function(*obfuscated_funcs[obfuscated_match])
 
         if not normal_metrics or not obfuscated_metrics:
             continue
@@ -268,7 +518,22 @@ def main():
         print(f"Error: Obfuscated binary not found: {obfuscated_path}")
         sys.exit(1)
 
-    compare_binaries(normal_path, obfuscated_path)
+    normal_is_listing = is_disassembly(normal_path)
+    obfuscated_is_listing = is_disassembly(obfuscated_path)
+
+    if not (normal_is_listing and obfuscated_is_listing) and shutil.which('objdump') is None:
+        print("Error: objdump not found in PATH")
+        sys.exit(1)
+
+    try:
+        compare_binaries(normal_path, obfuscated_path,
+                         normal_is_listing, obfuscated_is_listing)
+    except subprocess.TimeoutExpired as e:
+        print(f"Error: objdump timed out after {e.timeout} seconds")
+        sys.exit(1)
+    except subprocess.CalledProcessError as e:
+        print(f"Error: objdump failed with exit code {e.returncode}")
+        sys.exit(1)
 
 
 if __name__ == '__main__':